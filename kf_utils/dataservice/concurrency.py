@@ -0,0 +1,56 @@
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+from itertools import islice
+
+
+def bounded_map(executor, func, iterable, window):
+    """
+    Like executor.map, but pulls from the iterable lazily and only keeps
+    `window` calls submitted at a time, so a long input never turns into a
+    matching pile of queued futures. Results are yielded in input order.
+
+    :param executor: concurrent.futures executor to submit calls to
+    :param func: function to call on each item
+    :param iterable: items to call func with
+    :param window: maximum number of calls submitted but not yet yielded
+    :yields: func(item) for each item, in order
+    """
+    items = iter(iterable)
+    pending = deque(executor.submit(func, i) for i in islice(items, window))
+    try:
+        while pending:
+            f = pending.popleft()
+            # keep the workers busy while the caller handles this result
+            for i in islice(items, 1):
+                pending.append(executor.submit(func, i))
+            yield f.result()
+    finally:
+        for f in pending:
+            f.cancel()
+
+
+def bounded_as_completed(executor, func, iterable, window):
+    """
+    Like bounded_map, but results are yielded in the order the calls finish
+    instead of input order, so one slow call doesn't hold up the rest.
+
+    :param executor: concurrent.futures executor to submit calls to
+    :param func: function to call on each item
+    :param iterable: items to call func with
+    :param window: maximum number of calls submitted but not yet yielded
+    :yields: func(item) for each item, as each call finishes
+    """
+    items = iter(iterable)
+    pending = {executor.submit(func, i) for i in islice(items, window)}
+    try:
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for f in done:
+                # refill one at a time, like bounded_map, so calls that
+                # finished together don't push past the window
+                for i in islice(items, 1):
+                    pending.add(executor.submit(func, i))
+                yield f.result()
+    finally:
+        for f in pending:
+            f.cancel()
@@ -3,46 +3,114 @@ from pprint import pformat
 from urllib.parse import urlparse
 
 from d3b_utils.requests_retry import Session
+from requests.exceptions import RequestException
+from kf_utils.dataservice.concurrency import bounded_map
 from kf_utils.dataservice.meta import get_endpoint
 from kf_utils.dataservice.scrape import yield_kfids
+from kf_utils.dataservice.session import RETRY_STATUSES, with_pool_size
 
-# DO NOT RE-ORDER - deletion requires this order
-ENDPOINTS = [
-    "read-groups",
-    "read-group-genomic-files",
-    "sequencing-experiments",
-    "sequencing-experiment-genomic-files",
-    "genomic-files",
-    "biospecimen-genomic-files",
-    "biospecimens",
-    "outcomes",
-    "phenotypes",
-    "diagnoses",
-    "samples",
-    "sample-relationships",
-    "participants",
-    "family-relationships",
-    "families",
-]
+# Each endpoint maps to the endpoints that must be deleted before it, so that
+# deleting it doesn't set off a large cascading delete in the Data Service
+DELETION_DEPENDENCIES = {
+    "read-groups": set(),
+    "read-group-genomic-files": {"read-groups"},
+    "sequencing-experiments": set(),
+    "sequencing-experiment-genomic-files": {"sequencing-experiments"},
+    "genomic-files": {
+        "read-group-genomic-files",
+        "sequencing-experiment-genomic-files",
+    },
+    "biospecimen-genomic-files": {"genomic-files"},
+    "biospecimens": {"biospecimen-genomic-files"},
+    "outcomes": set(),
+    "phenotypes": set(),
+    "diagnoses": set(),
+    "samples": {"biospecimens"},
+    "sample-relationships": {"samples"},
+    "participants": {
+        "biospecimens",
+        "outcomes",
+        "phenotypes",
+        "diagnoses",
+        "samples",
+        "sample-relationships",
+    },
+    "family-relationships": {"participants"},
+    "families": {"participants", "family-relationships"},
+}
+
+
+def _deletion_order(dependencies):
+    """
+    Order endpoints so that each comes after everything it depends on. Ties
+    go to whichever endpoint was declared first, so the order is stable.
+    """
+    order = []
+    done = set()
+    while len(order) < len(dependencies):
+        for endpoint, deps in dependencies.items():
+            if (endpoint not in done) and (deps <= done):
+                order.append(endpoint)
+                done.add(endpoint)
+                break
+        else:
+            raise ValueError(
+                "Cyclic deletion dependencies among "
+                f"{set(dependencies) - done}"
+            )
+    return order
+
+
+def _deletion_layers(dependencies):
+    """
+    Group endpoints into layers where each endpoint's dependencies are all in
+    earlier layers, so the endpoints within a layer can be deleted at the
+    same time.
+    """
+    layers = []
+    done = set()
+    while len(done) < len(dependencies):
+        layer = [
+            endpoint
+            for endpoint, deps in dependencies.items()
+            if (endpoint not in done) and (deps <= done)
+        ]
+        if not layer:
+            raise ValueError(
+                "Cyclic deletion dependencies among "
+                f"{set(dependencies) - done}"
+            )
+        layers.append(layer)
+        done.update(layer)
+    return layers
+
+
+# Computed once at import. Deletion requires this order.
+ENDPOINTS = _deletion_order(DELETION_DEPENDENCIES)
+DELETION_LAYERS = _deletion_layers(DELETION_DEPENDENCIES)
 STUDIES = "studies"
 LOCAL_HOSTS = {
     "localhost",
     "127.0.0.1",
 }
+# How many deletes to send between progress messages
+REPORT_EVERY = 500
 
 
-def delete_kfids(host, kfids, safety_check=True):
-    """
-    Rapidly delete entities by KF ID. Default behavior only deletes resources
-    at localhost unless safety_check=False
+def _unique(items):
+    """Yield items in order, skipping any that were already yielded"""
+    seen = set()
+    for i in items:
+        if i not in seen:
+            seen.add(i)
+            yield i
 
-    :param host: dataservice base url string (e.g. "http://localhost:5000")
-    :type host: str
-    :param kfids: Data Service Kids First IDs
-    :type kfids: iterable of strs
+
+def _check_safety(host, safety_check):
+    """
+    Refuse to delete from hosts outside of LOCAL_HOSTS unless safety_check is
+    disabled.
     """
-    kfids = list(kfids)
-    host = host.strip("/")
     base = urlparse(host).netloc.split(":")[0]
     if safety_check and (base not in LOCAL_HOSTS):
         raise Exception(
@@ -51,18 +119,122 @@ def delete_kfids(host, kfids, safety_check=True):
             "unless you set safety_check=False."
         )
 
-    def delete(u):
-        return Session().delete(u)
 
-    total = len(kfids)
-    with ThreadPoolExecutor(max_workers=5) as tpex:
-        for i, f in enumerate(
-            tpex.map(delete, [f"{host}/{get_endpoint(k)}/{k}" for k in kfids])
+def delete_kfids(host, kfids, safety_check=True, max_workers=16):
+    """
+    Rapidly delete entities by KF ID. Default behavior only deletes resources
+    at localhost unless safety_check=False. Repeated KF IDs are only deleted
+    once.
+
+    :param host: dataservice base url string (e.g. "http://localhost:5000")
+    :type host: str
+    :param kfids: Data Service Kids First IDs
+    :type kfids: iterable of strs
+    :param max_workers: number of deletes to send concurrently
+    :type max_workers: int
+    :returns: dict mapping URLs that could not be deleted to their responses,
+        or to the exception raised if no response was received (e.g. after
+        running out of retries). KF IDs with an unknown prefix are mapped by
+        KF ID to the KeyError from looking up their endpoint.
+    """
+    host = host.strip("/")
+    _check_safety(host, safety_check)
+
+    # One session for the whole batch so that connections are kept alive and
+    # reused instead of paying for a new connection with every delete. Its
+    # pool matches the worker count so that no worker waits on a connection.
+    session = with_pool_size(
+        Session(status_forcelist=RETRY_STATUSES), max_workers
+    )
+
+    # Failures are reported instead of raised so that one bad delete doesn't
+    # stop the rest of the batch
+    def delete(kfid):
+        try:
+            u = f"{host}/{get_endpoint(kfid)}/{kfid}"
+        except KeyError as e:
+            return kfid, e
+        try:
+            return u, session.delete(u)
+        except RequestException as e:
+            return u, e
+
+    errors = {}
+    count = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as tpex:
+        for u, f in bounded_map(
+            tpex, delete, _unique(kfids), window=4 * max_workers
         ):
-            print(f"Deleted {i+1} of {total}: {f.url}")
+            count += 1
+            if isinstance(f, (KeyError, RequestException)):
+                errors[u] = f
+                print(f"Failed to delete {u} -- {f!r}")
+            elif not f.ok:
+                errors[u] = f
+                print(f"Failed to delete {u} -- {f.status_code}")
+            elif count % REPORT_EVERY == 0:
+                print(f"Deleted {count - len(errors)} so far: {u}")
+
+    print(f"Deleted {count - len(errors)} of {count} from {host}")
+    return errors
+
 
+def _delete_from_endpoint(host, endpoint, filters, safety_check, max_workers):
+    """
+    Find all entities at the endpoint that match the filters and delete them
+    with up to max_workers concurrent deletes.
 
-def delete_entities(host, study_ids=None, safety_check=True):
+    The scrape is completed before any deletes are sent because its final
+    count check would fail if entities disappeared while paginating.
+    """
+    where = f" from study {filters['study_id']}" if filters else ""
+    print(f"Finding all {endpoint}{where}.")
+    kfids = list(yield_kfids(host, endpoint, filters, show_progress=True))
+    if kfids:
+        print(f"Deleting all {endpoint}{where}.")
+        return delete_kfids(
+            host, kfids, safety_check=safety_check, max_workers=max_workers
+        )
+    else:
+        print(f"No {endpoint} found.")
+        return {}
+
+
+def _delete_by_layer(host, filters, safety_check, max_workers):
+    """
+    Delete everything matching the filters one DELETION_LAYERS layer at a
+    time, handling the endpoints within each layer concurrently. The
+    endpoints in a layer split max_workers between them, so the layer as a
+    whole never has more than max_workers deletes in flight. Stops after
+    any layer with failed deletes, because deleting the layers after it would
+    cascade into the entities that are still there.
+
+    :returns: dict of failed deletes, as returned by delete_kfids
+    """
+    errors = {}
+    widest = max(len(layer) for layer in DELETION_LAYERS)
+    with ThreadPoolExecutor(max_workers=widest) as tpex:
+        for layer in DELETION_LAYERS:
+            workers = max(1, max_workers // len(layer))
+
+            def delete_endpoint(endpoint):
+                return _delete_from_endpoint(
+                    host, endpoint, filters, safety_check, workers
+                )
+
+            # wait for the whole layer before starting the next one
+            for endpoint_errors in tpex.map(delete_endpoint, layer):
+                errors.update(endpoint_errors)
+            if errors:
+                print(
+                    f"Failed to delete {len(errors)} entities from {layer}. "
+                    "Not deleting anything that depends on them."
+                )
+                break
+    return errors
+
+
+def delete_entities(host, study_ids=None, safety_check=True, max_workers=16):
     """
     Delete entities by study or delete all entities in Data Service. If
     study_ids is not provided, all entities in Data Service will be deleted.
@@ -74,8 +246,9 @@ def delete_entities(host, study_ids=None, safety_check=True):
     the Data Service. For example, first we delete genomic files, then
     biospecimens, and then participants rather than deleting participants first
     since that would cause a cascading delete of the specimens and their
-    genomic files. The order in which entities are deleted is defined in
-    ENDPOINTS.
+    genomic files. The order in which entities are deleted is defined by
+    DELETION_DEPENDENCIES. Endpoints that don't depend on each other (e.g.
+    outcomes, phenotypes, and diagnoses) are deleted concurrently.
 
     :param host: URL of the Data Service
     :type host: str
@@ -84,42 +257,45 @@ def delete_entities(host, study_ids=None, safety_check=True):
     :type study_ids: list of str
     :param saftey_check: Whether to delete if resource is not at localhost
     :type safety_check: bool
+    :param max_workers: number of deletes to send concurrently, shared by the
+        endpoints being deleted at the same time
+    :type max_workers: int
+    :returns: dict mapping URLs that could not be deleted to their responses
+        (or exceptions). If any deletes fail, nothing that depends on them is
+        deleted.
     """
+    # Check before spending any time scraping what would be deleted
+    _check_safety(host, safety_check)
+
     phrase = f"studies {pformat(study_ids)}" if study_ids else "all studies"
     print(f"Deleting {phrase} from {host}")
 
+    errors = {}
     if study_ids:
         # Delete entities by study id
         for study_id in study_ids:
             # Delete entities except "study" (it has to be handled differently)
-            for endpoint in ENDPOINTS:
-                print(f"Finding all {endpoint} from study {study_id}.")
-                kfids = yield_kfids(
-                    host, endpoint, {"study_id": study_id}, show_progress=True
-                )
-                if kfids:
-                    print(f"Deleting all {endpoint} from study {study_id}.")
-                    delete_kfids(host, kfids, safety_check=safety_check)
-                else:
-                    print(f"No {endpoint} found.")
+            study_errors = _delete_by_layer(
+                host, {"study_id": study_id}, safety_check, max_workers
+            )
 
             # Delete study by its kfid
-            delete_kfids(host, [study_id], safety_check=safety_check)
+            if not study_errors:
+                study_errors = delete_kfids(
+                    host,
+                    [study_id],
+                    safety_check=safety_check,
+                    max_workers=max_workers,
+                )
+            errors.update(study_errors)
     else:
         # Delete everything
-        for endpoint in ENDPOINTS:
-            print(f"Finding all {endpoint}.")
-            kfids = yield_kfids(host, endpoint, {}, show_progress=True)
-            if kfids:
-                print(f"Deleting all {endpoint}.")
-                delete_kfids(host, kfids, safety_check=safety_check)
-            else:
-                print(f"No {endpoint} found.")
-
-        print(f"Finding all {STUDIES}.")
-        kfids = yield_kfids(host, STUDIES, {}, show_progress=True)
-        if kfids:
-            print(f"Deleting all {STUDIES}.")
-            delete_kfids(host, kfids, safety_check=safety_check)
-        else:
-            print(f"No {STUDIES} found.")
+        errors = _delete_by_layer(host, {}, safety_check, max_workers)
+        if not errors:
+            errors = _delete_from_endpoint(
+                host, STUDIES, {}, safety_check, max_workers
+            )
+
+    if errors:
+        print(f"Failed to delete {len(errors)} entities from {host}")
+    return errors
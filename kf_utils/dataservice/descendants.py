@@ -2,17 +2,101 @@
 Methods for finding descendant entities (participants in families, biospecimens
 in those participants, etc).
 """
-from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 import psycopg2
 import psycopg2.extras
+from kf_utils.dataservice.concurrency import bounded_map
 from kf_utils.dataservice.patch import hide_entities, unhide_entities
 from kf_utils.dataservice.scrape import yield_entities
+from kf_utils.dataservice.session import POOL_SIZE
 
+# Threads shared by every dataservice api lookup in this module, so that a
+# traversal doesn't start and stop a new pool for each step. Lookups go
+# through the shared session, so there's one worker per pooled connection.
+HTTP_WORKERS = POOL_SIZE
+_http_executor = ThreadPoolExecutor(
+    max_workers=HTTP_WORKERS, thread_name_prefix="kf-http"
+)
 
-def _accumulate(func, *args, **kwargs):
-    return list(func(*args, **kwargs))
+# Rows fetched from the database per round trip
+ITERSIZE = 5000
+
+
+def _fetch_all(api_url, queries, collect, session=None):
+    """
+    Concurrently fetch the entities for each (endpoint, field, value) query,
+    i.e. the entities from endpoint where field equals value. Each query's
+    entities are reduced by collect as they arrive, so only what the caller
+    needs from them is kept.
+
+    :param queries: iterable of (endpoint, field, value) tuples
+    :param collect: function taking an iterator of entities
+    :yields: (query, collect(entities)) for each query, in order
+    """
+    return bounded_map(
+        _http_executor,
+        lambda q: (
+            q,
+            collect(
+                yield_entities(
+                    api_url,
+                    q[0],
+                    {q[1]: q[2]},
+                    show_progress=True,
+                    session=session,
+                )
+            ),
+        ),
+        queries,
+        HTTP_WORKERS * 8,
+    )
+
+
+def _fetch_each(api_url, endpoint, field, values, collect, session=None):
+    """
+    Like _fetch_all for one endpoint and field with each of the given values.
+
+    :yields: (value, collect(entities)) for each value, in the order of values
+    """
+    queries = ((endpoint, field, v) for v in values)
+    for (_, _, v), found in _fetch_all(api_url, queries, collect, session):
+        yield v, found
+
+
+def _kfid_from_link(link):
+    """Get the kfid at the end of an entity link like /genomic-files/GF_..."""
+    return link.rpartition("/")[2]
+
+
+@contextmanager
+def _connect(db_url):
+    """
+    Open a database connection that is closed on exit. (psycopg2's own
+    connection context manager only ends the transaction.)
+    """
+    conn = psycopg2.connect(db_url)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def _query(conn, sql, params):
+    """
+    Run a query through a server-side cursor so that rows are streamed in
+    chunks of ITERSIZE instead of all being loaded into memory at once.
+
+    :yields: DictRow for each result row
+    """
+    with conn.cursor(
+        name="kf_utils_query", cursor_factory=psycopg2.extras.DictCursor
+    ) as cur:
+        cur.itersize = ITERSIZE
+        cur.execute(sql, params)
+        yield from cur
 
 
 # Maps of direct foreign key descendancy from studies down to genomic files
@@ -76,8 +160,44 @@ _api_descendancy = {
     ],
 }
 
+# Dataservice api endpoints and their database tables
+_ENDPOINT_TO_TABLE = {
+    "studies": "study",
+    "participants": "participant",
+    "family-relationships": "family_relationship",
+    "outcomes": "outcome",
+    "phenotypes": "phenotype",
+    "diagnoses": "diagnosis",
+    "biospecimens": "biospecimen",
+    "families": "family",
+    "biospecimen-genomic-files": "biospecimen_genomic_file",
+    "biospecimen-diagnoses": "biospecimen_diagnosis",
+    "genomic-files": "genomic_file",
+    "read-group-genomic-files": "read_group_genomic_file",
+    "sequencing-experiment-genomic-files": "sequencing_experiment_genomic_file",
+    "read-groups": "read_group",
+    "sequencing-experiments": "sequencing_experiment",
+}
+_TABLE_TO_ENDPOINT = {v: k for k, v in _ENDPOINT_TO_TABLE.items()}
+
 
-def find_gfs_with_extra_contributors(api_or_db_url, bs_kfids, gf_kfids=None):
+def _types_before(descendancy):
+    """
+    Map each parent type in a descendancy map to the set of types listed
+    before it. A traversal starting at that type skips those types, which are
+    above it in the hierarchy.
+    """
+    types = list(descendancy)
+    return {t: frozenset(types[:i]) for i, t in enumerate(types)}
+
+
+_DB_DONE_BEFORE = _types_before(_db_descendancy)
+_API_DONE_BEFORE = _types_before(_api_descendancy)
+
+
+def find_gfs_with_extra_contributors(
+    api_or_db_url, bs_kfids, gf_kfids=None, session=None
+):
     """
     Given a set of biospecimen KFIDs, find the KFIDs of descendant genomic
     files that also descend from biospecimens that aren't included in the given
@@ -92,10 +212,12 @@ def find_gfs_with_extra_contributors(api_or_db_url, bs_kfids, gf_kfids=None):
         "postgres://<USERNAME>:<PASSWORD>@kf-dataservice-postgres-prd.kids-first.io:5432/kfpostgresprd"
     :param bs_kfids: iterable of biospecimen KFIDs
     :param gf_kfids: iterable of genomic file KFIDs (optional)
+    :param session: requests Session for dataservice api requests (default:
+        the shared session)
     :returns: sets of KFIDs of genomic files with contributing biospecimens not
         included in bs_kfids, divided into these groups:
-            "all_visible": all extra contributors are visible in the dataservice
-            "all_hidden": all extra contributors are hidden in the dataservice
+            "visible": all extra contributors are visible in the dataservice
+            "hidden": all extra contributors are hidden in the dataservice
             "mixed_visibility": some extra contributors are hidden and some not
 
     Example:
@@ -107,32 +229,48 @@ def find_gfs_with_extra_contributors(api_or_db_url, bs_kfids, gf_kfids=None):
     """
     if api_or_db_url.startswith(("http:", "https:")):
         return _find_gfs_with_extra_contributors_with_http_api(
-            api_or_db_url, bs_kfids, gf_kfids=None
+            api_or_db_url, bs_kfids, gf_kfids=gf_kfids, session=session
         )
     else:
         return _find_gfs_with_extra_contributors_with_db_conn(
-            api_or_db_url, bs_kfids, gf_kfids=None
+            api_or_db_url, bs_kfids, gf_kfids=gf_kfids
         )
 
 
 def _find_gfs_with_extra_contributors_with_db_conn(
-    db_url, bs_kfids, gf_kfids=None
+    db_url, bs_kfids, gf_kfids=None, conn=None
 ):
-    """See find_gfs_with_extra_contributors"""
+    """
+    See find_gfs_with_extra_contributors. Uses the given open connection if
+    there is one instead of connecting to db_url.
+    """
+    if conn is None:
+        with _connect(db_url) as conn:
+            return _find_gfs_with_extra_contributors_with_db_conn(
+                db_url, bs_kfids, gf_kfids, conn
+            )
+
+    # Classify each genomic file by the visibility of its extra contributors
+    # in the database, returning one row per file instead of one per
+    # contributor
     sql = (
-        "select distinct extra.genomic_file_id, biospecimen.visible from"
+        "select extra.genomic_file_id,"
+        " bool_or(biospecimen.visible is true) as any_visible,"
+        " bool_or(biospecimen.visible is false) as any_hidden from"
         " biospecimen_genomic_file bg join biospecimen_genomic_file extra"
         " on bg.genomic_file_id = extra.genomic_file_id"
         " join biospecimen"
         " on biospecimen.kf_id = extra.biospecimen_id"
-        " where bg.biospecimen_id in %s and extra.biospecimen_id not in %s"
+        " where bg.biospecimen_id = any(%s::text[])"
+        " and extra.biospecimen_id <> all(%s::text[])"
     )
 
-    bs_kfids = tuple(bs_kfids)
-    kfid_tuples = (bs_kfids, bs_kfids)
+    bs_kfids = list(bs_kfids)
+    kfid_lists = (bs_kfids, bs_kfids)
     if gf_kfids:
-        kfid_tuples = (bs_kfids, bs_kfids, tuple(gf_kfids))
-        sql += " and extra.genomic_file_id in %s"
+        kfid_lists = (bs_kfids, bs_kfids, list(gf_kfids))
+        sql += " and extra.genomic_file_id = any(%s::text[])"
+    sql += " group by extra.genomic_file_id"
 
     has_extra_contributors = {
         "mixed_visibility": set(),
@@ -140,46 +278,60 @@ def _find_gfs_with_extra_contributors_with_db_conn(
         "visible": set(),
     }
 
-    storage = defaultdict(set)
-    with psycopg2.connect(db_url) as conn:
-        with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
-            cur.execute(sql, kfid_tuples)
-            for r in cur.fetchall():
-                storage[r["genomic_file_id"]].add(r["visible"])
-
-    for gfid, visset in storage.items():
-        if (False in visset) and (True in visset):
-            has_extra_contributors["mixed_visibility"].add(gfid)
-        elif False in visset:
-            has_extra_contributors["hidden"].add(gfid)
+    for r in _query(conn, sql, kfid_lists):
+        if r["any_hidden"] and r["any_visible"]:
+            has_extra_contributors["mixed_visibility"].add(r["genomic_file_id"])
+        elif r["any_hidden"]:
+            has_extra_contributors["hidden"].add(r["genomic_file_id"])
         else:
-            has_extra_contributors["visible"].add(gfid)
+            has_extra_contributors["visible"].add(r["genomic_file_id"])
 
     return has_extra_contributors
 
 
+def _any_extra_contributors(conn, gf_kfids, bs_kfids):
+    """
+    Quickly check whether any of the given genomic files have contributing
+    biospecimens outside of the given biospecimens, so that the full
+    classification can be skipped when (as for whole studies) none do.
+    """
+    sql = (
+        "select 1 from biospecimen_genomic_file"
+        " where genomic_file_id = any(%s::text[])"
+        " and biospecimen_id <> all(%s::text[]) limit 1"
+    )
+    with conn.cursor() as cur:
+        cur.execute(sql, (list(gf_kfids), list(bs_kfids)))
+        return cur.fetchone() is not None
+
+
 def _find_gfs_with_extra_contributors_with_http_api(
-    api_url, bs_kfids, gf_kfids=None
+    api_url, bs_kfids, gf_kfids=None, session=None
 ):
     """See find_gfs_with_extra_contributors"""
     bs_kfids = set(bs_kfids)
+
+    def _linked_gf_kfids():
+        # Yield each genomic file as soon as it is found so that its
+        # contributors can be requested while other biospecimens are still
+        # being looked up
+        seen = set()
+        for _, gs in _fetch_each(
+            api_url,
+            "biospecimen-genomic-files",
+            "biospecimen_id",
+            bs_kfids,
+            lambda bgs: {
+                _kfid_from_link(bg["_links"]["genomic_file"]) for bg in bgs
+            },
+            session,
+        ):
+            for g in gs - seen:
+                seen.add(g)
+                yield g
+
     if not gf_kfids:
-        gf_kfids = set()
-        with ThreadPoolExecutor() as tpex:
-            futures = [
-                tpex.submit(
-                    _accumulate,
-                    yield_entities,
-                    api_url,
-                    "biospecimen-genomic-files",
-                    {"biospecimen_id": k},
-                    show_progress=True,
-                )
-                for k in bs_kfids
-            ]
-            for f in as_completed(futures):
-                for bg in f.result():
-                    gf_kfids.add(bg["_links"]["genomic_file"].rsplit("/", 1)[1])
+        gf_kfids = _linked_gf_kfids()
     else:
         gf_kfids = set(gf_kfids)
 
@@ -188,33 +340,30 @@ def _find_gfs_with_extra_contributors_with_http_api(
         "hidden": set(),
         "visible": set(),
     }
-    with ThreadPoolExecutor() as tpex:
-        futures = {
-            tpex.submit(
-                _accumulate,
-                yield_entities,
-                api_url,
-                "biospecimens",
-                {"genomic_file_id": g},
-                show_progress=True,
-            ): g
-            for g in gf_kfids
-        }
-        for f in as_completed(futures):
-            g = futures[f]
-            contribs = {
-                bs["kf_id"]: (bs["visible"] is True) for bs in f.result()
-            }
-            contrib_kfids = set(contribs.keys())
-            if not contrib_kfids.issubset(bs_kfids):
-                extra_kfids = contrib_kfids - bs_kfids
-                extras_visible = set(contribs[k] for k in extra_kfids)
-                if (False in extras_visible) and (True in extras_visible):
-                    has_extra_contributors["mixed_visibility"].add(g)
-                elif False in extras_visible:
-                    has_extra_contributors["hidden"].add(g)
+    for g, contribs in _fetch_each(
+        api_url,
+        "biospecimens",
+        "genomic_file_id",
+        gf_kfids,
+        lambda bss: {bs["kf_id"]: (bs["visible"] is True) for bs in bss},
+        session,
+    ):
+        extra_kfids = contribs.keys() - bs_kfids
+        if extra_kfids:
+            any_visible = any_hidden = False
+            for k in extra_kfids:
+                if contribs[k]:
+                    any_visible = True
                 else:
-                    has_extra_contributors["visible"].add(g)
+                    any_hidden = True
+                if any_visible and any_hidden:
+                    break
+            if any_hidden and any_visible:
+                has_extra_contributors["mixed_visibility"].add(g)
+            elif any_hidden:
+                has_extra_contributors["hidden"].add(g)
+            else:
+                has_extra_contributors["visible"].add(g)
     return has_extra_contributors
 
 
@@ -224,6 +373,8 @@ def find_descendants_by_kfids(
     parents,
     ignore_gfs_with_hidden_external_contribs,
     kfids_only=True,
+    session=None,
+    cache=None,
 ):
     """
     Given a set of KFIDs from a specified endpoint, find the KFIDs of all
@@ -246,7 +397,9 @@ def find_descendants_by_kfids(
     the hidden biospecimens also get hidden.
 
     Special performance note: a database connect url will run MUCH faster
-    compared to a dataservice api host
+    compared to a dataservice api host. With an api host,
+    ignore_gfs_with_hidden_external_contribs=True also costs one request per
+    descendant genomic file to find its contributing biospecimens.
 
     :param api_or_db_url: dataservice api host _or_ database connect url
         e.g. "https://kf-api-dataservice.kidsfirstdrc.org" or
@@ -258,147 +411,215 @@ def find_descendants_by_kfids(
         genomic files (and their descendants) that contain information from
         hidden biospecimens unrelated to the given parents.
     :param kfids_only: only return KFIDs, not entire entities
+    :param session: requests Session for dataservice api requests (default:
+        the shared session)
+    :param cache: dict for reusing results of repeated calls with the same
+        arguments (optional). Cached results are returned as-is, so don't
+        modify them, and don't reuse a cache after changing visibility.
     :returns: dict mapping endpoints to their sets of discovered kfids
     """
-    use_api = api_or_db_url.startswith(("http:", "https:"))
+    if cache is not None:
+        if isinstance(parents, str):
+            parents = [parents]
+        parents = list(parents)
+        key = (
+            api_or_db_url,
+            parent_endpoint,
+            frozenset(
+                p["kf_id"] if isinstance(p, dict) else p for p in parents
+            ),
+            ignore_gfs_with_hidden_external_contribs,
+            kfids_only,
+        )
+        if key in cache:
+            return cache[key]
+
+    args = (
+        parent_endpoint,
+        parents,
+        ignore_gfs_with_hidden_external_contribs,
+        kfids_only,
+        session,
+    )
+    if api_or_db_url.startswith(("http:", "https:")):
+        descendants = _find_descendants(api_or_db_url, None, *args)
+    else:
+        # One connection serves the whole traversal
+        with _connect(api_or_db_url) as db_conn:
+            descendants = _find_descendants(api_or_db_url, db_conn, *args)
+
+    if cache is not None:
+        cache[key] = descendants
+    return descendants
+
+
+def _find_descendants(
+    api_or_db_url,
+    db_conn,
+    parent_endpoint,
+    parents,
+    ignore_gfs_with_hidden_external_contribs,
+    kfids_only,
+    session,
+):
+    """
+    See find_descendants_by_kfids. db_conn is an open connection to
+    api_or_db_url, or None when api_or_db_url is a dataservice api host.
+    """
+    use_api = db_conn is None
 
     if use_api:
         parent_type = parent_endpoint
     else:
-        endpoint_to_table = {
-            "studies": "study",
-            "participants": "participant",
-            "family-relationships": "family_relationship",
-            "outcomes": "outcome",
-            "phenotypes": "phenotype",
-            "diagnoses": "diagnosis",
-            "biospecimens": "biospecimen",
-            "families": "family",
-            "biospecimen-genomic-files": "biospecimen_genomic_file",
-            "biospecimen-diagnoses": "biospecimen_diagnosis",
-            "genomic-files": "genomic_file",
-            "read-group-genomic-files": "read_group_genomic_file",
-            "sequencing-experiment-genomic-files": "sequencing_experiment_genomic_file",
-            "read-groups": "read_group",
-            "sequencing-experiments": "sequencing_experiment",
-        }
-        table_to_endpoint = {v: k for k, v in endpoint_to_table.items()}
-        parent_type = endpoint_to_table[parent_endpoint]
+        parent_type = _ENDPOINT_TO_TABLE[parent_endpoint]
 
     if use_api:
         descendancy = _api_descendancy
+        done_before = _API_DONE_BEFORE
+        gf_type, bs_type = "genomic-files", "biospecimens"
     else:
         descendancy = _db_descendancy
-        db_conn = psycopg2.connect(api_or_db_url)
-        db_cur = db_conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        done_before = _DB_DONE_BEFORE
+        gf_type, bs_type = "genomic_file", "biospecimen"
 
     if isinstance(parents, str):
         parents = [parents]
+    elif not isinstance(parents, (list, tuple)):
+        # materialize once so that peeking at the first parent doesn't consume
+        # it from a generator
+        parents = list(parents)
+
+    # With kfids_only, only kfids are collected (and only kf_id columns are
+    # read from the database) instead of whole entities keyed by kfid
+    def _collect(entities):
+        if kfids_only:
+            return {e["kf_id"] for e in entities}
+        else:
+            return {e["kf_id"]: dict(e) for e in entities}
+
+    columns = "kf_id" if kfids_only else "*"
 
-    if isinstance(next(iter(parents), None), dict):
+    if parents and isinstance(parents[0], dict):
         parent_kfids = set(p["kf_id"] for p in parents)
-        descendants = {parent_type: {p["kf_id"]: p for p in parents}}
+        if kfids_only:
+            descendants = {parent_type: set(parent_kfids)}
+        else:
+            descendants = {parent_type: {p["kf_id"]: p for p in parents}}
     else:
         parent_kfids = set(parents)
         if use_api:
-            descendants = {
-                parent_type: {
-                    e["kf_id"]: e
-                    for e in yield_entities(api_or_db_url, None, parent_kfids)
-                }
-            }
+            rows = yield_entities(
+                api_or_db_url, None, parent_kfids, session=session
+            )
         else:
-            query = f"select distinct * from {parent_type} where kf_id in %s"
-            db_cur.execute(query, (tuple(parent_kfids | {None}),))
-            descendants = {
-                parent_type: {p["kf_id"]: dict(p) for p in db_cur.fetchall()}
-            }
-
-    done = set()
-    for t in descendancy.keys():
-        if t != parent_type:
-            done.add(t)
-        else:
-            break
+            query = (
+                f"select {columns} from {parent_type}"
+                " where kf_id = any(%s::text[])"
+            )
+            rows = _query(db_conn, query, (list(parent_kfids),))
+        descendants = {parent_type: _collect(rows)}
+
+    done = set(done_before.get(parent_type, descendancy))
 
     def _inner(parent_type, parent_kfids, descendants):
         if parent_type in done:
             return
         done.add(parent_type)
-        for (child_type, link_on_parent, link_on_child) in descendancy.get(
-            parent_type, []
-        ):
+        edges = descendancy.get(parent_type, [])
+        if use_api:
+            # Request the children for every edge in one fan-out, so that
+            # sibling endpoints are fetched at the same time instead of one
+            # after another
+            found = {}
+            queries = (
+                (child_type, link_on_child, k)
+                for (child_type, _, link_on_child) in edges
+                for k in parent_kfids
+            )
+            for (child_type, link_on_child, _), children in _fetch_all(
+                api_or_db_url, queries, _collect, session
+            ):
+                found.setdefault((child_type, link_on_child), _collect(()))
+                found[child_type, link_on_child].update(children)
+
+        for (child_type, link_on_parent, link_on_child) in edges:
             if use_api:
-                with ThreadPoolExecutor() as tpex:
-                    futures = [
-                        tpex.submit(
-                            _accumulate,
-                            yield_entities,
-                            api_or_db_url,
-                            child_type,
-                            {link_on_child: k},
-                            show_progress=True,
-                        )
-                        for k in parent_kfids
-                    ]
-                    children = {
-                        e["kf_id"]: e
-                        for f in as_completed(futures)
-                        for e in f.result()
-                    }
+                children = found.get((child_type, link_on_child))
             else:
                 # special case for getting to families from studies
                 if parent_type == "study" and child_type == "family":
                     query = (
-                        "select distinct family.* from family join participant"
+                        f"select distinct family.{columns} from family join participant"
                         " on participant.family_id = family.kf_id join study on"
                         " participant.study_id = study.kf_id where study.kf_id "
-                        "in %s"
+                        "= any(%s::text[])"
                     )
                 else:
+                    # Joining a child's foreign key to its parent's kf_id
+                    # finds each child once, but a child found by its own
+                    # kf_id (e.g. a genomic file from its
+                    # biospecimen_genomic_files) can be found many times
+                    distinct = "distinct " if link_on_child == "kf_id" else ""
                     query = (
-                        f"select distinct {child_type}.* from {child_type} join {parent_type}"
+                        f"select {distinct}{child_type}.{columns} from {child_type} join {parent_type}"
                         f" on {child_type}.{link_on_child} = {parent_type}.{link_on_parent}"
-                        f" where {parent_type}.kf_id in %s"
+                        f" where {parent_type}.kf_id = any(%s::text[])"
                     )
-                db_cur.execute(query, (tuple(parent_kfids | {None}),))
-                children = {c["kf_id"]: dict(c) for c in db_cur.fetchall()}
+                rows = _query(db_conn, query, (list(parent_kfids),))
+                children = _collect(rows)
 
             if children:
-                descendants[child_type] = descendants.get(child_type, dict())
-                descendants[child_type].update(children)
+                if child_type in descendants:
+                    descendants[child_type].update(children)
+                else:
+                    descendants[child_type] = children
 
             if (
-                child_type == "genomic_file"
-            ) and ignore_gfs_with_hidden_external_contribs:
+                (child_type == gf_type)
+                and ignore_gfs_with_hidden_external_contribs
+                and descendants.get(gf_type)
+            ):
                 # Ignore multi-specimen genomic files that have hidden
                 # contributing specimens which are not in the descendants
-                extra_contrib_gfs = find_gfs_with_extra_contributors(
-                    api_or_db_url,
-                    descendants["biospecimen"],
-                    descendants["genomic_file"],
-                )
-                to_remove = (
-                    extra_contrib_gfs["hidden"]
-                    | extra_contrib_gfs["mixed_visibility"]
-                )
-                descendants["genomic_file"] = {
-                    k: v
-                    for k, v in descendants["genomic_file"].items()
-                    if k not in to_remove
-                }
-        for (child_type, _, _) in descendancy.get(parent_type, []):
-            if descendants.get(child_type):
-                _inner(child_type, descendants[child_type].keys(), descendants)
+                gfs, bss = descendants[gf_type], descendants[bs_type]
+                if use_api:
+                    extra_contrib_gfs = (
+                        _find_gfs_with_extra_contributors_with_http_api(
+                            api_or_db_url, bss, gf_kfids=gfs, session=session
+                        )
+                    )
+                elif _any_extra_contributors(db_conn, gfs, bss):
+                    extra_contrib_gfs = (
+                        _find_gfs_with_extra_contributors_with_db_conn(
+                            api_or_db_url, bss, conn=db_conn
+                        )
+                    )
+                else:
+                    extra_contrib_gfs = None
+
+                if extra_contrib_gfs:
+                    to_remove = (
+                        extra_contrib_gfs["hidden"]
+                        | extra_contrib_gfs["mixed_visibility"]
+                    )
+                    if kfids_only:
+                        descendants[gf_type] -= to_remove
+                    else:
+                        descendants[gf_type] = {
+                            k: v
+                            for k, v in descendants[gf_type].items()
+                            if k not in to_remove
+                        }
+        # a child type can be linked by more than one edge, but only needs to
+        # be descended into once
+        for child_type in dict.fromkeys(e[0] for e in edges):
+            if child_type not in done and descendants.get(child_type):
+                _inner(child_type, descendants[child_type], descendants)
 
     _inner(parent_type, parent_kfids, descendants)
 
     if not use_api:
-        descendants = {table_to_endpoint[k]: v for k, v in descendants.items()}
-
-    if kfids_only:
-        for k, v in descendants.items():
-            descendants[k] = set(descendants[k])
+        descendants = {_TABLE_TO_ENDPOINT[k]: v for k, v in descendants.items()}
 
     return descendants
 
@@ -410,12 +631,18 @@ def find_descendants_by_filter(
     ignore_gfs_with_hidden_external_contribs,
     kfids_only=True,
     db_url=None,
+    session=None,
+    cache=None,
 ):
     """
     Similar to find_descendants_by_kfids but starts with an API endpoint filter
     instead of a list of endpoint KFIDs.
     """
-    things = list(yield_entities(api_url, endpoint, filter, show_progress=True))
+    things = list(
+        yield_entities(
+            api_url, endpoint, filter, show_progress=True, session=session
+        )
+    )
     if kfids_only:
         things = [t["kf_id"] for t in things]
 
@@ -425,6 +652,8 @@ def find_descendants_by_filter(
         things,
         ignore_gfs_with_hidden_external_contribs,
         kfids_only=kfids_only,
+        session=session,
+        cache=cache,
     )
     return descendants
 
@@ -27,7 +27,7 @@ prefix_endpoints = {
 
 
 def prefix(kfid):
-    return kfid.split("_")[0]
+    return kfid.partition("_")[0]
 
 
 def get_endpoint(kfid):
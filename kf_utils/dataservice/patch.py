@@ -1,34 +1,56 @@
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
 
-from d3b_utils.requests_retry import Session
+from kf_utils.dataservice.concurrency import bounded_as_completed
 from kf_utils.dataservice.meta import get_endpoint
+from kf_utils.dataservice.session import POOL_SIZE, get_session
 
 
-def send_patches(host, patches):
+def send_patches(host, patches, session=None):
     """
     Rapidly submit patch requests to the server.
 
     :param host: dataservice base url string (e.g. "http://localhost:5000")
     :param patches: dict mapping KFIDs to patch dicts
-    :raises Exception: if server doesn't respond OK
+    :param session: requests Session to use (default: the shared session)
+    :raises Exception: if server doesn't respond OK for any patch (after all
+        patches have been sent)
     """
     host = host.strip("/")
-
-    def do_patch(url, patch):
-        msg = f"Patched {url} with {patch}"
-        resp = Session().patch(url, json=patch)
-        if not resp.ok:
-            raise Exception(f"{resp.status_code} -- {msg} -- {resp.json()}")
-        return msg
-
-    with ThreadPoolExecutor() as tpex:
-        futures = []
-        for kfid, patch in patches.items():
-            endpoint = get_endpoint(kfid)
-            url = f"{host}/{endpoint}/{kfid}"
-            futures.append(tpex.submit(do_patch, url, patch))
-        for f in as_completed(futures):
-            print(f.result())
+    session = session or get_session()
+
+    # Failures are returned instead of raised so that one bad patch doesn't
+    # stop the rest from being sent
+    def do_patch(kfid_and_patch):
+        kfid, patch = kfid_and_patch
+        try:
+            url = f"{host}/{get_endpoint(kfid)}/{kfid}"
+            msg = f"Patched {url} with {patch}"
+            resp = session.patch(url, json=patch)
+            if not resp.ok:
+                raise Exception(
+                    f"{resp.status_code} -- {msg} -- {resp.json()}"
+                )
+            return msg, None
+        except Exception as e:
+            return None, e
+
+    failures = []
+    # One worker per pooled connection, with a few patches queued per worker
+    with ThreadPoolExecutor(max_workers=POOL_SIZE) as tpex:
+        for msg, error in bounded_as_completed(
+            tpex, do_patch, patches.items(), 4 * POOL_SIZE
+        ):
+            if error is None:
+                print(msg)
+            else:
+                failures.append(error)
+                print(f"Failed to patch -- {error!r}")
+
+    if failures:
+        raise Exception(
+            f"{len(failures)} of {len(patches)} patches failed. "
+            f"First failure: {failures[0]}"
+        ) from failures[0]
 
 
 def patch_things_with_func(host, things, patch_func):
@@ -1,8 +1,21 @@
-from collections import defaultdict
-
 from d3b_utils.aws_bucket_contents import fetch_bucket_obj_info
 from kf_utils.dataservice.scrape import yield_entities
 
+# Dataservice genomic file fields left out of the report
+_KF_SKIPPED_FIELDS = frozenset(("_links", "access_urls", "urls"))
+
+
+class _FieldNames(dict):
+    """Maps field names to prefixed, lowercased report column names, making
+    each name only once instead of once per record."""
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+
+    def __missing__(self, field):
+        name = self[field] = f"{self.prefix}{field.lower()}"
+        return name
+
 
 def merge_s3_and_kf_gfs(
     ds_url, study_kfid, study_bucket, exclude_s3_keypaths=None
@@ -23,53 +36,47 @@ def merge_s3_and_kf_gfs(
     :type exclude_s3_keypaths: string, iterable
     :return: list of dicts
     """
-    # Files from the dataservice
-    # We use the API because direct DB queries won't give us the gen3 fields
-    kf = {
-        e["external_id"]: {
-            f"kf_{k.lower()}": v
-            for k, v in e.items()
-            if k not in ["_links", "access_urls", "urls"]
-        }
-        for e in yield_entities(
-            ds_url,
-            "genomic-files",
-            {"study_id": study_kfid},
-            show_progress=True,
-        )
-    }
+    # Sadly it's muuuuch harder to exclude paths on the S3 request side because
+    # the S3 API doesn't support it. So we're stuck for now waiting for
+    # potentially thousands of pagination requests that we don't care about,
+    # and then we skip them here.
+    if not exclude_s3_keypaths:
+        exclude_s3_keypaths = ()
+    elif isinstance(exclude_s3_keypaths, str):
+        exclude_s3_keypaths = (exclude_s3_keypaths,)
+    else:
+        exclude_s3_keypaths = tuple(exclude_s3_keypaths)
+
+    s3_names = _FieldNames("s3_")
+    kf_names = _FieldNames("kf_")
 
     # Files from S3
     s3 = {
         "s3://"
         + o["Bucket"]
         + "/"
-        + o["Key"]: {f"s3_{k.lower()}": v for k, v in o.items()}
+        + o["Key"]: {s3_names[k]: v for k, v in o.items()}
         for o in fetch_bucket_obj_info(
             study_bucket,
             drop_folders=True,
         )
+        if not o["Key"].startswith(exclude_s3_keypaths)
     }
 
-    # Sadly it's muuuuch harder to exclude paths on the S3 request side because
-    # the S3 API doesn't support it. So we're stuck for now waiting for
-    # potentially thousands of pagination requests that we don't care about,
-    # and then we remove them here.
-    if exclude_s3_keypaths:
-        if isinstance(exclude_s3_keypaths, str):
-            exclude_s3_keypaths = (exclude_s3_keypaths,)
-        elif exclude_s3_keypaths is not None:
-            exclude_s3_keypaths = tuple(exclude_s3_keypaths)
-
-        s3 = {
-            k: v
-            for k, v in s3.items()
-            if not v["s3_key"].startswith(exclude_s3_keypaths)
-        }
-
-    # Merge them together
-    s3kf = defaultdict(dict, s3)
-    for k, v in kf.items():
-        s3kf[k].update(v)
+    # Files from the dataservice, merged in as they arrive
+    # We use the API because direct DB queries won't give us the gen3 fields
+    for e in yield_entities(
+        ds_url,
+        "genomic-files",
+        {"study_id": study_kfid},
+        show_progress=True,
+    ):
+        s3.setdefault(e["external_id"], {}).update(
+            {
+                kf_names[k]: v
+                for k, v in e.items()
+                if k not in _KF_SKIPPED_FIELDS
+            }
+        )
 
-    return list(s3kf.values())
+    return list(s3.values())
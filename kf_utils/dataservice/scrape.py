@@ -1,11 +1,22 @@
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
 
-from d3b_utils.requests_retry import Session
+from kf_utils.dataservice.concurrency import bounded_as_completed
 from kf_utils.dataservice.meta import get_endpoint
+from kf_utils.dataservice.session import POOL_SIZE, get_session
 from tqdm import tqdm
 
+# orjson decodes responses several times faster than the standard library
+# when it's installed
+try:
+    import orjson as json
+except ImportError:
+    import json
 
-def yield_entities_from_filter(host, endpoint, filters, show_progress=False):
+
+def yield_entities_from_filter(
+    host, endpoint, filters, show_progress=False, session=None, page_size=100
+):
     """
     Scrape the dataservice for paginated entities matching the filter params.
 
@@ -17,6 +28,9 @@ def yield_entities_from_filter(host, endpoint, filters, show_progress=False):
     :param endpoint: dataservice endpoint string (e.g. "genomic-files")
     :param filters: dict of filters to winnow results from the dataservice
         (e.g. {"study_id": "SD_DYPMEHHF", "external_id": "foo"})
+    :param session: requests Session to use (default: the shared session)
+    :param page_size: entities requested per page, at most 100 (the
+        dataservice's limit)
     :raises Exception: if the dataservice doesn't return status 200
     :yields: entities matching the filters
     """
@@ -25,83 +39,126 @@ def yield_entities_from_filter(host, endpoint, filters, show_progress=False):
     url = f"{host}/{endpoint}"
 
     found_kfids = set()
-    which = {"limit": 100}
+    which = {"limit": page_size}
     expected = 0
-    with tqdm(total=1, disable=not show_progress, leave=False) as pbar:
-        while True:
-            resp = Session().get(url, params={**which, **filters})
-
-            if resp.status_code != 200:
-                raise Exception(resp.text)
-
-            j = resp.json()
-            if j["total"] != expected:
-                n = pbar.n
-                pbar.reset(j["total"])
-                pbar.update(n)
-
-            expected = j["total"]
-            res = j["results"]
-
-            if not res:
-                pbar.close()
-            for entity in res:
-                kfid = entity["kf_id"]
-                if kfid not in found_kfids:
-                    found_kfids.add(kfid)
+    session = session or get_session()
+
+    def get_page(which):
+        return session.get(url, params={**which, **filters})
+
+    # The next page is requested as soon as its cursor is known so that it
+    # downloads while the caller works through the current page. Most
+    # scrapes are a single page, so the first page is fetched directly and
+    # the prefetch thread is only started once a second page is needed.
+    tpex = None
+    try:
+        with tqdm(total=1, disable=not show_progress, leave=False) as pbar:
+            resp = get_page(dict(which))
+            while resp is not None:
+                if resp.status_code != 200:
+                    raise Exception(resp.text)
+
+                j = json.loads(resp.content)
+                if j["total"] != expected:
+                    n = pbar.n
+                    pbar.reset(j["total"])
+                    pbar.update(n)
+
+                expected = j["total"]
+                res = j["results"]
+
+                new = []
+                for entity in res:
+                    kfid = entity["kf_id"]
+                    if kfid not in found_kfids:
+                        found_kfids.add(kfid)
+                        new.append(entity)
+
+                # Once everything has been found, don't ask for the empty
+                # page that would follow.
+                next_page = None
+                if len(found_kfids) < expected:
+                    try:
+                        cursor = parse_qs(urlsplit(j["_links"]["next"]).query)
+                        for key in ("after", "after_uuid"):
+                            which[key] = cursor[key][0]
+                        if tpex is None:
+                            tpex = ThreadPoolExecutor(max_workers=1)
+                        next_page = tpex.submit(get_page, dict(which))
+                    except KeyError:
+                        pass
+
+                if not res:
+                    pbar.close()
+                for entity in new:
                     pbar.update()
                     yield entity
-            try:
-                for (key, i) in [("after", 1), ("after_uuid", 2)]:
-                    which[key] = j["_links"]["next"].split("=")[i].split("&")[0]
-            except KeyError:
-                break
+
+                resp = next_page.result() if next_page else None
+    finally:
+        if tpex is not None:
+            tpex.shutdown()
 
     num = len(found_kfids)
     assert expected == num, f"FOUND {num} ENTITIES BUT EXPECTED {expected}"
 
 
-def yield_entities_from_kfids(host, kfids, show_progress=False):
+def yield_entities_from_kfids(host, kfids, show_progress=False, session=None):
     """Fetch the given entities from the dataservice quickly.
 
     :param host: dataservice base url string (e.g. "http://localhost:5000")
-    :param kfids: kfids to request entities for
+    :param kfids: kfids to request entities for (duplicates are only
+        requested and yielded once)
+    :param session: requests Session to use (default: the shared session)
     :raises Exception: if the dataservice doesn't return status 200
     :yields: entities for the given kfids
     """
     host = host.strip("/")
+    kfids = list(dict.fromkeys(kfids))
 
     quit = False
+    session = session or get_session()
 
-    def do_get(url):
+    def do_get(kfid):
         if quit:
             return
-        response = Session().get(url)
+        response = session.get(f"{host}/{get_endpoint(kfid)}/{kfid}")
         if response.status_code != 200:
             raise Exception(response.text)
-        body = response.json()
+        body = json.loads(response.content)
         res = body["results"]
         res["_links"] = body["_links"]
         return res
 
-    with ThreadPoolExecutor() as tpex:
-        futures = [
-            tpex.submit(do_get, f"{host}/{get_endpoint(k)}/{k}") for k in kfids
-        ]
+    # One worker per pooled connection, with a few requests queued per worker
+    tpex = ThreadPoolExecutor(max_workers=POOL_SIZE)
+    wait = True
+    try:
         with tqdm(total=len(kfids), disable=not show_progress) as pbar:
-            try:
-                for f in as_completed(futures):
-                    pbar.update()
-                    yield f.result()
-            except KeyboardInterrupt:
-                quit = True
-                tpex.shutdown(wait=False)
-                tpex._threads.clear()
-                raise
+            for entity in bounded_as_completed(
+                tpex, do_get, kfids, 4 * POOL_SIZE
+            ):
+                pbar.update()
+                yield entity
+    except KeyboardInterrupt:
+        # Queued requests were cancelled when bounded_as_completed stopped,
+        # and the quit flag turns any that already started into no-ops.
+        # Don't wait on the requests already in flight, which could be
+        # retrying for minutes.
+        quit = True
+        wait = False
+        raise
+    finally:
+        tpex.shutdown(wait=wait)
 
 
 def yield_entities(
-    host, endpoint_if_filter, filters_or_kfids, show_progress=False
+    host,
+    endpoint_if_filter,
+    filters_or_kfids,
+    show_progress=False,
+    session=None,
+    page_size=100,
 ):
     """Combined call for yield_entities_from_filter and
     yield_entities_from_kfids to preserve backward compatibility because
@@ -113,6 +170,8 @@ def yield_entities(
     :param filters_or_kfids: dict of filters to winnow results from the
         dataservice (e.g. {"study_id": "SD_DYPMEHHF", "external_id": "foo"})
         or a list of kfids
+    :param session: requests Session to use (default: the shared session)
+    :param page_size: entities requested per page when filtering, at most 100
     :raises Exception: if the dataservice doesn't return status 200
     :yields: matching entities
     """
@@ -126,14 +185,20 @@ def yield_entities(
             endpoint_if_filter,
             filters_or_kfids,
             show_progress=show_progress,
+            session=session,
+            page_size=page_size,
         )
     else:
         return yield_entities_from_kfids(
-            host, filters_or_kfids, show_progress=show_progress
+            host, filters_or_kfids, show_progress=show_progress, session=session
         )
 
 
-def yield_kfids(host, endpoint, filters, show_progress=False):
+def yield_kfids(
+    host, endpoint, filters, show_progress=False, session=None, page_size=100
+):
     """Wrapper around yield_entities_from_filter that yields just KFIDs"""
-    for e in yield_entities_from_filter(host, endpoint, filters, show_progress):
+    for e in yield_entities_from_filter(
+        host, endpoint, filters, show_progress, session, page_size
+    ):
         yield e["kf_id"]
@@ -0,0 +1,53 @@
+import threading
+
+from d3b_utils.requests_retry import Session
+from requests.adapters import HTTPAdapter
+
+# Connections the shared session keeps open per host
+POOL_SIZE = 16
+
+# Responses that get retried (with backoff) instead of returned. 429 is
+# included so that bursts of concurrent requests back off when throttled.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_shared_session = None
+_shared_session_lock = threading.Lock()
+
+
+def with_pool_size(session, pool_size):
+    """
+    Remount a session's http and https adapters with connection pools large
+    enough for pool_size concurrent requests, keeping its retry settings.
+
+    :param session: requests Session
+    :param pool_size: number of connections to keep open per host
+    :returns: the same session
+    """
+    for prefix in ("http://", "https://"):
+        session.mount(
+            prefix,
+            HTTPAdapter(
+                pool_connections=pool_size,
+                pool_maxsize=pool_size,
+                max_retries=session.get_adapter(prefix).max_retries,
+            ),
+        )
+    return session
+
+
+def get_session():
+    """
+    Get the session shared by dataservice requests in this process, creating
+    it on first use. Reusing one session keeps connections alive between
+    requests instead of setting up a new one (and a new TLS handshake) for
+    every request.
+
+    :returns: requests Session
+    """
+    global _shared_session
+    with _shared_session_lock:
+        if _shared_session is None:
+            _shared_session = with_pool_size(
+                Session(status_forcelist=RETRY_STATUSES), POOL_SIZE
+            )
+        return _shared_session
@@ -5,6 +5,13 @@ from xml.etree import ElementTree
 # from defusedxml import ElementTree as DefusedET
 # from defusedxml.common import DefusedXmlException
 
+# Seconds to wait on dbGaP before giving up on a request
+REQUEST_TIMEOUT = 60
+
+# Retry backoff factor for dbGaP requests. The first retry is immediate and
+# later ones wait 0.4s, 0.8s, 1.6s...
+RETRY_BACKOFF = 0.2
+
 
 def get_latest_sample_status(phs_id, required_status="released"):
     """Get the most recently released sample status for a study on dbGaP
@@ -17,6 +24,10 @@ def get_latest_sample_status(phs_id, required_status="released"):
     """
     tried = {}
     version = None
+    # one session for every version tried so they share a connection
+    session = Session(
+        status_forcelist=(502, 503, 504), backoff_factor=RETRY_BACKOFF
+    )
     while True:
         phs_string = f"{phs_id}.v{version}" if version is not None else phs_id
         url = (
@@ -27,7 +38,7 @@ def get_latest_sample_status(phs_id, required_status="released"):
         print(f"Querying dbGaP for study {phs_string}")
         print(f"Manifest URL -> {url}")
 
-        data = Session(status_forcelist=(502, 503, 504)).get(url)
+        data = session.get(url, timeout=REQUEST_TIMEOUT)
         if data.status_code != 200:
             tried[phs_string] = f"status {data.status_code}"
             raise Exception(
@@ -1,8 +1,30 @@
+import atexit
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
+
 import pytest
 import requests
+from requests.adapters import HTTPAdapter
 from kf_utils.dataservice.delete import delete_entities
 
 DATASERVICE_URL = "http://localhost:5000"
+SEQUENCING_CENTERS_URL = f"{DATASERVICE_URL}/sequencing-centers"
+STUDIES_URL = f"{DATASERVICE_URL}/studies"
+PARTICIPANTS_URL = f"{DATASERVICE_URL}/participants"
+BIOSPECIMENS_URL = f"{DATASERVICE_URL}/biospecimens"
+
+# Concurrent requests populate_data makes at each level
+POPULATE_WORKERS = 16
+
+# Shared by the test helpers so requests reuse connections to dataservice
+session = requests.Session()
+session.mount(
+    "http://",
+    HTTPAdapter(
+        pool_connections=POPULATE_WORKERS, pool_maxsize=POPULATE_WORKERS
+    ),
+)
+atexit.register(session.close)
 
 
 @pytest.fixture
@@ -15,31 +37,43 @@ def dataservice_setup():
     delete_entities(DATASERVICE_URL)
 
 
+def _sd(si):
+    return f"SD_{si}".ljust(11, "1")
+
+
+def _pt(si, pi):
+    return f"PT_{si}{pi}".ljust(11, "1")
+
+
+def _bs(si, pi, bi):
+    return f"BS_{si}{pi}{bi}".ljust(11, "1")
+
+
 def create_sequencing_center():
     kfid = "SC_11111111"
-    requests.post(
-        f"{DATASERVICE_URL}/sequencing-centers",
+    session.post(
+        SEQUENCING_CENTERS_URL,
         json={"kf_id": kfid, "external_id": "x", "name": "x"},
     )
     return kfid
 
 
 def create_study(si):
-    kfid = f"SD_{si}".ljust(11, "1")
-    requests.post(
-        f"{DATASERVICE_URL}/studies",
+    kfid = _sd(si)
+    session.post(
+        STUDIES_URL,
         json={"kf_id": kfid, "external_id": f"{si}"},
     )
     return kfid
 
 
 def create_participant(si, pi):
-    kfid = f"PT_{si}{pi}".ljust(11, "1")
-    requests.post(
-        f"{DATASERVICE_URL}/participants",
+    kfid = _pt(si, pi)
+    session.post(
+        PARTICIPANTS_URL,
         json={
             "kf_id": kfid,
-            "study_id": f"SD_{si}".ljust(11, "1"),
+            "study_id": _sd(si),
             "external_id": f"{pi}",
         },
     )
@@ -47,12 +81,12 @@ def create_participant(si, pi):
 
 
 def create_biospecimen(si, pi, bi):
-    kfid = f"BS_{si}{pi}{bi}".ljust(11, "1")
-    requests.post(
-        f"{DATASERVICE_URL}/biospecimens",
+    kfid = _bs(si, pi, bi)
+    session.post(
+        BIOSPECIMENS_URL,
         json={
             "kf_id": kfid,
-            "participant_id": f"PT_{si}{pi}".ljust(11, "1"),
+            "participant_id": _pt(si, pi),
             "external_sample_id": f"{pi}{bi}",
             "external_aliquot_id": f"{pi}{bi}",
             "sequencing_center_id": "SC_11111111",
@@ -67,13 +101,22 @@ def populate_data(ns, np=None, nb=None):
         np = ns
     if nb is None:
         nb = np
-    # Create some data in dataservice
+    # Create some data in dataservice. Each level only depends on the one
+    # above it, so the entities within a level are created concurrently.
     kfids = []
     kfids.append(create_sequencing_center())
-    for si in range(ns):
-        kfids.append(create_study(si))
-        for pi in range(np):
-            kfids.append(create_participant(si, pi))
-            for bi in range(nb):
-                kfids.append(create_biospecimen(si, pi, bi))
+    with ThreadPoolExecutor(max_workers=POPULATE_WORKERS) as tpex:
+        kfids.extend(tpex.map(create_study, range(ns)))
+        kfids.extend(
+            tpex.map(
+                lambda args: create_participant(*args),
+                product(range(ns), range(np)),
+            )
+        )
+        kfids.extend(
+            tpex.map(
+                lambda args: create_biospecimen(*args),
+                product(range(ns), range(np), range(nb)),
+            )
+        )
     return kfids
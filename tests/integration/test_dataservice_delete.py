@@ -1,6 +1,5 @@
-from tests.conftest import DATASERVICE_URL, populate_data
+from tests.conftest import DATASERVICE_URL, populate_data, session
 
-import requests
 from kf_utils.dataservice.delete import delete_entities, ENDPOINTS, STUDIES
 
 
@@ -28,7 +27,7 @@ def test_delete_entities(dataservice_setup):
     }
     for endpoint, payloads in data.items():
         for p in payloads:
-            resp = requests.post(f"{DATASERVICE_URL}/{endpoint}", json=p)
+            resp = session.post(f"{DATASERVICE_URL}/{endpoint}", json=p)
 
     # Delete first two studies
     sids = [s["kf_id"] for s in data["studies"][0:2]]
@@ -38,8 +37,8 @@ def test_delete_entities(dataservice_setup):
     for i in range(n_studies):
         kfid = data["studies"][i]["kf_id"]
         params = {"study_id": kfid}
-        study_resp = requests.get(f"{DATASERVICE_URL}/studies/{kfid}")
-        part_resp = requests.get(
+        study_resp = session.get(f"{DATASERVICE_URL}/studies/{kfid}")
+        part_resp = session.get(
             f"{DATASERVICE_URL}/participants", params=params
         )
         if i <= 1:
@@ -54,7 +53,7 @@ def test_delete_entities(dataservice_setup):
 
     # Check all study entities deleted
     for endpoint in ENDPOINTS + [STUDIES]:
-        resp = requests.get(f"{DATASERVICE_URL}/{endpoint}")
+        resp = session.get(f"{DATASERVICE_URL}/{endpoint}")
         assert resp.json()["total"] == 0
 
 
@@ -0,0 +1,145 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from kf_utils.dataservice.concurrency import bounded_as_completed, bounded_map
+
+BOUNDED = [bounded_map, bounded_as_completed]
+
+
+class RecordingExecutor(ThreadPoolExecutor):
+    """ThreadPoolExecutor that keeps every future it hands out"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.futures = []
+
+    def submit(self, *args, **kwargs):
+        f = super().submit(*args, **kwargs)
+        self.futures.append(f)
+        return f
+
+
+class Pulls:
+    """Iterable over range(n) that counts how many items have been taken"""
+
+    def __init__(self, n):
+        self.n = n
+        self.pulled = 0
+
+    def __iter__(self):
+        for i in range(self.n):
+            self.pulled += 1
+            yield i
+
+
+def test_bounded_map_order():
+    """
+    Test that bounded_map yields in input order even when calls finish out
+    of order
+    """
+
+    def func(i):
+        time.sleep(0.01 * (5 - i % 5))
+        return i * 2
+
+    with ThreadPoolExecutor(max_workers=4) as tpex:
+        assert list(bounded_map(tpex, func, range(20), 6)) == [
+            i * 2 for i in range(20)
+        ]
+
+
+def test_bounded_as_completed_order():
+    """
+    Test that bounded_as_completed yields calls as they finish
+    """
+    release = {i: threading.Event() for i in range(3)}
+
+    def func(i):
+        release[i].wait(5)
+        return i
+
+    with ThreadPoolExecutor(max_workers=3) as tpex:
+        results = bounded_as_completed(tpex, func, range(3), 3)
+        for i in [2, 0, 1]:
+            release[i].set()
+            assert next(results) == i
+        assert list(results) == []
+
+
+@pytest.mark.parametrize("bounded", BOUNDED)
+@pytest.mark.parametrize("window", [1, 3, 8])
+def test_window(bounded, window):
+    """
+    Test that no more than window calls are submitted and not yet yielded,
+    and that the input is only pulled as calls are submitted
+    """
+    items = Pulls(30)
+    with RecordingExecutor(max_workers=4) as tpex:
+        yielded = 0
+        for _ in bounded(tpex, lambda i: i, items, window):
+            yielded += 1
+            assert len(tpex.futures) - yielded <= window
+            assert items.pulled == len(tpex.futures)
+        assert yielded == 30
+
+
+@pytest.mark.parametrize("bounded", BOUNDED)
+def test_lazy(bounded):
+    """
+    Test that creating and starting the generator doesn't exhaust the input
+    """
+    items = Pulls(1000)
+    with ThreadPoolExecutor(max_workers=2) as tpex:
+        results = bounded(tpex, lambda i: i, items, 4)
+        assert items.pulled == 0
+        next(results)
+        assert items.pulled <= 5
+        results.close()
+
+
+@pytest.mark.parametrize("bounded", BOUNDED)
+def test_cancel_on_close(bounded):
+    """
+    Test that pending calls are cancelled when the generator is closed early
+    """
+    release = threading.Event()
+
+    def func(i):
+        if i > 0:
+            release.wait(5)
+        return i
+
+    with RecordingExecutor(max_workers=1) as tpex:
+        results = bounded(tpex, func, range(100), 10)
+        assert next(results) == 0
+        results.close()
+        release.set()
+        # 10 submitted up front and 1 more to replace the one yielded. The
+        # one worker may have started the next call, but everything queued
+        # behind it was cancelled.
+        assert len(tpex.futures) == 11
+        assert sum(f.cancelled() for f in tpex.futures) >= 9
+
+
+@pytest.mark.parametrize("bounded", BOUNDED)
+def test_cancel_on_error(bounded):
+    """
+    Test that a call raising is re-raised and pending calls are cancelled
+    """
+    release = threading.Event()
+
+    def func(i):
+        if i == 0:
+            raise ValueError("failed")
+        release.wait(5)
+        return i
+
+    with RecordingExecutor(max_workers=1) as tpex:
+        with pytest.raises(ValueError):
+            list(bounded(tpex, func, range(100), 10))
+        release.set()
+        assert len(tpex.futures) == 11
+        assert sum(f.cancelled() for f in tpex.futures) >= 9
@@ -1,11 +1,13 @@
 import pytest
 from unittest.mock import MagicMock, call
 
-from requests.exceptions import HTTPError
+from requests.exceptions import ConnectionError, HTTPError, RetryError
 
 from kf_utils.dataservice.delete import (
     delete_kfids,
     delete_entities,
+    DELETION_DEPENDENCIES,
+    DELETION_LAYERS,
     ENDPOINTS,
     STUDIES,
 )
@@ -13,6 +15,45 @@ from kf_utils.dataservice.delete import (
 HOST = "http://localhost:5000"
 
 
+def test_endpoint_order():
+    """
+    Test that ENDPOINTS puts every endpoint after its dependencies
+    """
+    assert set(ENDPOINTS) == set(DELETION_DEPENDENCIES)
+    for i, endpoint in enumerate(ENDPOINTS):
+        assert DELETION_DEPENDENCIES[endpoint] <= set(ENDPOINTS[:i])
+
+    assert ENDPOINTS == [
+        "read-groups",
+        "read-group-genomic-files",
+        "sequencing-experiments",
+        "sequencing-experiment-genomic-files",
+        "genomic-files",
+        "biospecimen-genomic-files",
+        "biospecimens",
+        "outcomes",
+        "phenotypes",
+        "diagnoses",
+        "samples",
+        "sample-relationships",
+        "participants",
+        "family-relationships",
+        "families",
+    ]
+
+
+def test_deletion_layers():
+    """
+    Test that DELETION_LAYERS only depend on earlier layers
+    """
+    done = set()
+    for layer in DELETION_LAYERS:
+        for endpoint in layer:
+            assert DELETION_DEPENDENCIES[endpoint] <= done
+        done.update(layer)
+    assert done == set(ENDPOINTS)
+
+
 @pytest.mark.parametrize(
     "url,safety_check,should_error",
     [
@@ -52,6 +93,18 @@ def test_safety_check(mocker, url, safety_check, should_error):
         delete_kfids(url, kfids, safety_check=safety_check)
 
 
+def test_delete_entities_safety_check(mocker):
+    """
+    Test that delete_entities refuses non-local hosts before scraping
+    """
+    mock_yield_kfids = mocker.patch("kf_utils.dataservice.delete.yield_kfids")
+
+    with pytest.raises(Exception) as e:
+        delete_entities("http://prd.dataservice.org", study_ids=["SD_0"])
+    assert "safety_check is ENABLED" in str(e.value)
+    mock_yield_kfids.assert_not_called()
+
+
 def test_delete_kfids(mocker):
     """
     Test kf_utils.dataservice.delete.delete_kfids
@@ -63,11 +116,68 @@ def test_delete_kfids(mocker):
     kfids = [f"PT_{i}" for i in range(2)]
 
     # Successful delete
-    delete_kfids(HOST, kfids)
+    assert not delete_kfids(HOST, kfids)
     assert mock_session.delete.call_count == len(kfids)
     mock_session.reset_mock()
     mock_resp.reset_mock()
 
+    # Repeated kfids are only deleted once
+    delete_kfids(HOST, kfids + kfids)
+    assert mock_session.delete.call_count == len(kfids)
+    mock_session.reset_mock()
+    mock_resp.reset_mock()
+
+    # Failed delete
+    mock_resp.ok = False
+    mock_resp.url = f"{HOST}/redirected"
+    errors = delete_kfids(HOST, kfids)
+    assert errors == {f"{HOST}/participants/{k}": mock_resp for k in kfids}
+    mock_session.reset_mock()
+    mock_resp.reset_mock()
+
+
+def test_delete_kfids_request_errors(mocker):
+    """
+    Test that delete_kfids reports deletes that raise instead of stopping
+    """
+    mock_session = mocker.patch("kf_utils.dataservice.delete.Session")()
+    mock_resp = MagicMock()
+    exceptions = {
+        "PT_1": RetryError("too many 503 error responses"),
+        "PT_3": ConnectionError("connection refused"),
+    }
+
+    def delete(url):
+        kfid = url.rpartition("/")[2]
+        if kfid in exceptions:
+            raise exceptions[kfid]
+        return mock_resp
+
+    mock_session.delete.side_effect = delete
+    kfids = [f"PT_{i}" for i in range(5)]
+
+    errors = delete_kfids(HOST, kfids)
+    assert mock_session.delete.call_count == len(kfids)
+    assert errors == {
+        f"{HOST}/participants/{k}": e for k, e in exceptions.items()
+    }
+
+
+def test_delete_kfids_unknown_prefix(mocker):
+    """
+    Test that delete_kfids reports KF IDs with unknown prefixes and still
+    deletes the rest
+    """
+    mock_session = mocker.patch("kf_utils.dataservice.delete.Session")()
+    mock_session.delete.return_value = MagicMock()
+    kfids = [f"PT_{i}" for i in range(200)] + ["XX_bad"]
+    kfids += [f"BS_{i}" for i in range(200)]
+
+    errors = delete_kfids(HOST, kfids)
+    assert mock_session.delete.call_count == len(kfids) - 1
+    assert list(errors) == ["XX_bad"]
+    assert isinstance(errors["XX_bad"], KeyError)
+
 
 def test_delete_entities(mocker):
     """
@@ -83,7 +193,10 @@ def test_delete_entities(mocker):
     # Delete entities in multiple studies
     delete_entities(HOST, study_ids=study_ids)
     mock_delete_kfids.assert_has_calls(
-        [call(HOST, [sid], safety_check=True) for sid in study_ids],
+        [
+            call(HOST, [sid], safety_check=True, max_workers=16)
+            for sid in study_ids
+        ],
         any_order=True,
     )
     mock_yield_kfids.assert_has_calls(
@@ -110,3 +223,52 @@ def test_delete_entities(mocker):
     )
     mock_yield_kfids.reset_mock()
     mock_delete_kfids.reset_mock()
+
+
+def test_delete_entities_stops_on_errors(mocker):
+    """
+    Test that delete_entities doesn't delete past a layer with failures
+    """
+    mock_yield_kfids = mocker.patch("kf_utils.dataservice.delete.yield_kfids")
+    mock_delete_kfids = mocker.patch("kf_utils.dataservice.delete.delete_kfids")
+    failed = DELETION_LAYERS[0][0]
+    mock_yield_kfids.side_effect = lambda host, endpoint, *a, **kw: [endpoint]
+    mock_delete_kfids.side_effect = lambda host, kfids, **kw: (
+        {kfids[0]: "failed"} if kfids == [failed] else {}
+    )
+
+    for study_ids in [["SD_0", "SD_1"], None]:
+        errors = delete_entities(HOST, study_ids=study_ids)
+        assert errors == {failed: "failed"}
+
+        # Only the first layer is scraped, and no study is deleted
+        scraped = {c.args[1] for c in mock_yield_kfids.call_args_list}
+        assert scraped == set(DELETION_LAYERS[0])
+        deleted = {
+            k for c in mock_delete_kfids.call_args_list for k in c.args[1]
+        }
+        assert deleted == set(DELETION_LAYERS[0])
+        mock_yield_kfids.reset_mock()
+        mock_delete_kfids.reset_mock()
+
+
+def test_delete_entities_max_workers(mocker):
+    """
+    Test that the endpoints in a layer share delete_entities' max_workers
+    """
+    mock_yield_kfids = mocker.patch("kf_utils.dataservice.delete.yield_kfids")
+    mock_delete_kfids = mocker.patch("kf_utils.dataservice.delete.delete_kfids")
+    mock_yield_kfids.side_effect = lambda host, endpoint, *a, **kw: [endpoint]
+    mock_delete_kfids.return_value = {}
+
+    for max_workers in [1, 4, 16]:
+        delete_entities(HOST, max_workers=max_workers)
+        workers = {
+            c.args[1][0]: c.kwargs["max_workers"]
+            for c in mock_delete_kfids.call_args_list
+        }
+        for layer in DELETION_LAYERS:
+            assert all(workers[e] >= 1 for e in layer)
+            assert sum(workers[e] for e in layer) <= max(max_workers, len(layer))
+        assert workers[STUDIES] == max_workers
+        mock_delete_kfids.reset_mock()
@@ -0,0 +1,134 @@
+import pytest
+
+from kf_utils.dataservice import descendants
+from kf_utils.dataservice.descendants import find_descendants_by_kfids
+
+HOST = "http://localhost:5000"
+
+# SD_1 has participant PT_1 with biospecimens BS_1 and BS_2. GF_1 is shared
+# with a hidden biospecimen from another study, GF_3 with a visible one, and
+# GF_2 only comes from SD_1.
+BIOSPECIMENS = {
+    "BS_1": {"kf_id": "BS_1", "visible": True, "participant_id": "PT_1"},
+    "BS_2": {"kf_id": "BS_2", "visible": True, "participant_id": "PT_1"},
+    "BS_X": {"kf_id": "BS_X", "visible": False, "participant_id": "PT_X"},
+    "BS_Y": {"kf_id": "BS_Y", "visible": True, "participant_id": "PT_Y"},
+}
+GF_CONTRIBUTORS = {
+    "GF_1": ["BS_1", "BS_X"],
+    "GF_2": ["BS_1"],
+    "GF_3": ["BS_2", "BS_Y"],
+}
+
+
+@pytest.fixture
+def fake_yield_entities(mocker):
+    """
+    Patch descendants.yield_entities to serve the small graph above the way
+    the dataservice api would
+    """
+
+    def yield_entities(host, endpoint, filters_or_kfids, **kwargs):
+        if not isinstance(filters_or_kfids, dict):
+            return [{"kf_id": k, "visible": True} for k in filters_or_kfids]
+        ((field, value),) = filters_or_kfids.items()
+        if (endpoint, field) == ("participants", "study_id"):
+            return (
+                [{"kf_id": "PT_1", "visible": True}] if value == "SD_1" else []
+            )
+        if (endpoint, field) == ("biospecimens", "participant_id"):
+            return [
+                b
+                for b in BIOSPECIMENS.values()
+                if b["participant_id"] == value
+            ]
+        if (endpoint, field) == ("genomic-files", "biospecimen_id"):
+            return [
+                {"kf_id": g, "visible": True}
+                for g, bs in GF_CONTRIBUTORS.items()
+                if value in bs
+            ]
+        if (endpoint, field) == ("biospecimens", "genomic_file_id"):
+            return [BIOSPECIMENS[b] for b in GF_CONTRIBUTORS[value]]
+        return []
+
+    return mocker.patch.object(
+        descendants, "yield_entities", side_effect=yield_entities
+    )
+
+
+@pytest.mark.parametrize("kfids_only", [True, False])
+def test_api_extra_contributors(fake_yield_entities, kfids_only):
+    """
+    Test that api traversals drop genomic files with hidden external
+    contributors only when asked to
+    """
+    found = find_descendants_by_kfids(
+        HOST, "studies", ["SD_1"], True, kfids_only=kfids_only
+    )
+    assert set(found["biospecimens"]) == {"BS_1", "BS_2"}
+    assert set(found["genomic-files"]) == {"GF_2", "GF_3"}
+
+    found = find_descendants_by_kfids(
+        HOST, "studies", ["SD_1"], False, kfids_only=kfids_only
+    )
+    assert set(found["genomic-files"]) == {"GF_1", "GF_2", "GF_3"}
+
+
+def test_cache_hit(fake_yield_entities):
+    """
+    Test that a repeated call returns the cached result without new requests
+    """
+    cache = {}
+    first = find_descendants_by_kfids(
+        HOST, "studies", ["SD_1"], True, cache=cache
+    )
+    calls = fake_yield_entities.call_count
+    second = find_descendants_by_kfids(
+        HOST, "studies", ("SD_1",), True, cache=cache
+    )
+    assert second is first
+    assert fake_yield_entities.call_count == calls
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {"ignore_gfs_with_hidden_external_contribs": False},
+        {"kfids_only": False},
+    ],
+)
+def test_cache_miss(fake_yield_entities, kwargs):
+    """
+    Test that changing the ignore or kfids_only flags misses the cache
+    """
+    cache = {}
+    args = {"ignore_gfs_with_hidden_external_contribs": True, "cache": cache}
+    first = find_descendants_by_kfids(HOST, "studies", ["SD_1"], **args)
+    calls = fake_yield_entities.call_count
+    second = find_descendants_by_kfids(
+        HOST, "studies", ["SD_1"], **{**args, **kwargs}
+    )
+    assert second is not first
+    assert fake_yield_entities.call_count > calls
+    assert len(cache) == 2
+
+
+def test_cache_dict_parents(fake_yield_entities):
+    """
+    Test that entity parents and kfid parents share a cache key
+    """
+    cache = {}
+    first = find_descendants_by_kfids(
+        HOST,
+        "studies",
+        [{"kf_id": "SD_1", "visible": True}],
+        True,
+        cache=cache,
+    )
+    calls = fake_yield_entities.call_count
+    second = find_descendants_by_kfids(
+        HOST, "studies", "SD_1", True, cache=cache
+    )
+    assert second is first
+    assert fake_yield_entities.call_count == calls
@@ -0,0 +1,48 @@
+import pytest
+from unittest.mock import MagicMock
+
+from kf_utils.dataservice.patch import send_patches
+
+HOST = "http://localhost:5000"
+
+
+def mock_session(failing):
+    """Mock session whose patches fail with 404 for the failing kfids"""
+
+    def patch(url, json):
+        resp = MagicMock()
+        resp.ok = url.rpartition("/")[2] not in failing
+        resp.status_code = 200 if resp.ok else 404
+        resp.json.return_value = {"message": "not found"}
+        return resp
+
+    session = MagicMock()
+    session.patch.side_effect = patch
+    return session
+
+
+def test_send_patches():
+    """
+    Test kf_utils.dataservice.patch.send_patches
+    """
+    session = mock_session(set())
+    patches = {f"PT_{i}": {"visible": False} for i in range(50)}
+
+    send_patches(HOST, patches, session=session)
+    assert session.patch.call_count == len(patches)
+    sent = {c.args[0]: c.kwargs["json"] for c in session.patch.call_args_list}
+    assert sent == {f"{HOST}/participants/{k}": p for k, p in patches.items()}
+
+
+def test_send_patches_failures():
+    """
+    Test that send_patches sends every patch before raising for failures
+    """
+    session = mock_session({"PT_0", "PT_500"})
+    patches = {f"PT_{i}": {"visible": False} for i in range(1000)}
+    patches["XX_0"] = {"visible": False}
+
+    with pytest.raises(Exception) as e:
+        send_patches(HOST, patches, session=session)
+    assert "3 of 1001 patches failed" in str(e.value)
+    assert session.patch.call_count == 1000
@@ -0,0 +1,116 @@
+import json
+from unittest.mock import MagicMock
+from urllib.parse import urlencode
+
+import pytest
+
+from kf_utils.dataservice.scrape import yield_entities_from_filter
+
+HOST = "http://localhost:5000"
+ENDPOINT = "participants"
+FILTERS = {"study_id": "SD_00000000"}
+
+
+def mock_session(n, total=None):
+    """
+    Mock session serving n participants a page at a time the way the Data
+    Service does, with a next link carrying the after/after_uuid cursor of
+    the last entity on the page
+    """
+    entities = [
+        {"kf_id": f"PT_{i:08}", "created_at": float(i), "uuid": f"u{i}"}
+        for i in range(n)
+    ]
+
+    def get(url, params):
+        assert url == f"{HOST}/{ENDPOINT}"
+        start = 0
+        if "after" in params:
+            start = 1 + next(
+                i
+                for i, e in enumerate(entities)
+                if e["uuid"] == params["after_uuid"]
+            )
+            assert entities[start - 1]["created_at"] == float(params["after"])
+        page = entities[start : start + params["limit"]]
+        links = {}
+        if page:
+            cursor = {
+                "after": page[-1]["created_at"],
+                "after_uuid": page[-1]["uuid"],
+            }
+            links["next"] = f"/{ENDPOINT}?{urlencode({**params, **cursor})}"
+        resp = MagicMock(status_code=200)
+        resp.content = json.dumps(
+            {
+                "total": n if total is None else total,
+                "results": page,
+                "_links": links,
+            }
+        )
+        return resp
+
+    session = MagicMock()
+    session.get.side_effect = get
+    return session
+
+
+@pytest.mark.parametrize(
+    "n,page_size,gets",
+    [(250, 100, 3), (200, 100, 2), (0, 100, 1), (1, 100, 1), (25, 10, 3)],
+)
+def test_yield_entities_from_filter_pages(n, page_size, gets):
+    """
+    Test that every entity is found without asking for the empty page after
+    the last one
+    """
+    session = mock_session(n)
+    found = list(
+        yield_entities_from_filter(
+            HOST, ENDPOINT, FILTERS, session=session, page_size=page_size
+        )
+    )
+    assert [e["kf_id"] for e in found] == [f"PT_{i:08}" for i in range(n)]
+    assert session.get.call_count == gets
+
+    # Every page sends the filters and page size, and each page after the
+    # first sends the cursor from the page before it
+    for i, c in enumerate(session.get.call_args_list):
+        params = c.kwargs["params"]
+        assert params["limit"] == page_size
+        assert params["study_id"] == FILTERS["study_id"]
+        if i == 0:
+            assert "after" not in params and "after_uuid" not in params
+        else:
+            last = i * page_size - 1
+            assert params["after"] == str(float(last))
+            assert params["after_uuid"] == f"u{last}"
+
+
+def test_yield_entities_from_filter_count_check():
+    """
+    Test that finding fewer entities than the reported total fails
+    """
+    session = mock_session(5, total=8)
+    with pytest.raises(AssertionError) as e:
+        list(
+            yield_entities_from_filter(
+                HOST, ENDPOINT, FILTERS, session=session
+            )
+        )
+    assert "FOUND 5 ENTITIES BUT EXPECTED 8" in str(e.value)
+
+
+def test_yield_entities_from_filter_error():
+    """
+    Test that a non-200 response raises
+    """
+    session = MagicMock()
+    session.get.return_value = MagicMock(status_code=500, text="oops")
+    with pytest.raises(Exception) as e:
+        list(
+            yield_entities_from_filter(
+                HOST, ENDPOINT, FILTERS, session=session
+            )
+        )
+    assert "oops" in str(e.value)